@@ -0,0 +1,33 @@
+"""
+Queue-backed logging shared by the server and the agent processes.
+
+Records are only enqueued by the caller (usually the event loop); one listener
+thread does the actual, blocking writes to stdout.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging(level: int = logging.INFO, prefix: str = "") -> logging.Logger:
+    """Route the root logger through a QueueHandler. Safe to call more than once.
+
+    `prefix` goes in front of every line, e.g. "[AGENT <call_id>] " for an agent
+    subprocess that writes straight to the server's stdout.
+    """
+    global _listener
+    if _listener is None:
+        q: queue.SimpleQueue = queue.SimpleQueue()
+        logging.basicConfig(
+            level=level,
+            format=prefix.replace("%", "%%") + "%(message)s",
+            handlers=[logging.handlers.QueueHandler(q)],
+        )
+        _listener = logging.handlers.QueueListener(q, logging.StreamHandler(sys.stdout))
+        _listener.start()
+        atexit.register(_listener.stop)
+    return logging.getLogger("rehabai")
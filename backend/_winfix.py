@@ -0,0 +1,13 @@
+"""
+Windows event-loop and console fixes, applied on import (no-op elsewhere).
+"""
+import asyncio
+import sys
+
+if sys.platform == "win32":
+    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    # Already UTF-8 under PYTHONUTF8=1 / PYTHONIOENCODING=utf-8 — no need to rewrap
+    if (sys.stdout.encoding or "").lower() not in ("utf-8", "utf8"):
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
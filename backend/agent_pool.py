@@ -0,0 +1,87 @@
+"""
+RehabAI - Pool of pre-warmed agent worker processes
+
+The server starts N `rehab_agent.py --worker` processes at boot. Each imports
+the agent stack once and then serves sessions handed to it over its own Unix
+socket, so /start-agent pays neither interpreter startup nor imports.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import sys
+from pathlib import Path
+
+# Resolved once; every agent process (pool worker or per-session) runs this file
+AGENT_SCRIPT = str((Path(__file__).parent / "rehab_agent.py").resolve())
+READY_TIMEOUT = 120  # seconds for a worker to warm up and open its socket
+RESTART_DELAY = 1.0  # seconds before a dead worker is started again
+
+log = logging.getLogger("rehabai")
+
+
+class AgentPool:
+    def __init__(self, size: int, socket_prefix: str):
+        self.sockets = [f"{socket_prefix}.{i}" for i in range(size)]
+        self._procs: list[asyncio.subprocess.Process | None] = [None] * size
+        self._watchers: list[asyncio.Task] = []
+        self._next = itertools.cycle(range(size))
+        self._stopping = False
+
+    async def start(self) -> None:
+        for i in range(len(self.sockets)):
+            await self._spawn(i)
+        self._watchers = [asyncio.create_task(self._watch(i)) for i in range(len(self.sockets))]
+        await asyncio.gather(*(self._wait_ready(i) for i in range(len(self.sockets))))
+
+    def live_sockets(self) -> list[str]:
+        """Sockets of the workers still alive, in round-robin order from the next one."""
+        start, n = next(self._next), len(self.sockets)
+        order = [(start + k) % n for k in range(n)]
+        return [self.sockets[i] for i in order
+                if self._procs[i] is not None and self._procs[i].returncode is None]
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in self._watchers:
+            task.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        live = [p for p in self._procs if p is not None and p.returncode is None]
+        for proc in live:
+            proc.terminate()
+        await asyncio.gather(*(proc.wait() for proc in live))
+        for path in self.sockets:
+            Path(path).unlink(missing_ok=True)
+
+    async def _spawn(self, i: int) -> None:
+        path = self.sockets[i]
+        Path(path).unlink(missing_ok=True)  # _wait_ready watches for it to reappear
+        self._procs[i] = await asyncio.create_subprocess_exec(
+            sys.executable, AGENT_SCRIPT, "--worker",
+            # .env already parsed by the server. Workers share our stdout and tag their own lines
+            env={**os.environ, "REHAB_ENV_LOADED": "1",
+                 "REHAB_AGENT_SOCKET": path, "REHAB_LOG_PREFIX": f"[WORKER {i}] "},
+        )
+
+    async def _wait_ready(self, i: int) -> None:
+        path = Path(self.sockets[i])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + READY_TIMEOUT
+        while not path.exists():
+            if self._procs[i].returncode is not None or loop.time() > deadline:
+                log.error(f"[RehabAI] ❌ Agent worker {i} did not come up")
+                return
+            await asyncio.sleep(0.2)
+        log.info(f"[RehabAI] ✅ Agent worker {i} ready on {path}")
+
+    async def _watch(self, i: int) -> None:
+        """Start worker `i` again whenever it dies, until stop()."""
+        while True:
+            code = await self._procs[i].wait()
+            if self._stopping:
+                return
+            log.error(f"[RehabAI] ❌ Agent worker {i} exited with code {code}, restarting")
+            # Also keeps a worker that crashes on startup from spinning
+            await asyncio.sleep(RESTART_DELAY)
+            await self._spawn(i)
+            await self._wait_ready(i)
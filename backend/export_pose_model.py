@@ -0,0 +1,33 @@
+"""
+RehabAI - Export the YOLO pose weights for a faster inference backend
+Run: uv run python export_pose_model.py
+
+With a CUDA GPU this builds a TensorRT FP16 engine. On CPU it builds an INT8
+OpenVINO model (needs `pip install openvino`; calibrated on POSE_CALIB_DATA),
+or plain ONNX when OpenVINO is missing.
+rehab_agent.py picks the export up automatically when it sits next to YOLO_MODEL.
+Exports are built for REHAB_POSE_IMGSZ (default 416), the size the agent runs at,
+with a dynamic batch of up to yolo_service.BATCH_MAX frames for the shared batcher.
+"""
+import importlib.util
+import os
+
+import torch
+from ultralytics import YOLO
+
+from yolo_service import BATCH_MAX
+
+weights = os.environ.get("YOLO_MODEL", "yolo11n-pose.pt")
+imgsz = int(os.environ.get("REHAB_POSE_IMGSZ", "416"))
+model = YOLO(weights)
+batch = {"dynamic": True, "batch": BATCH_MAX}
+
+if torch.cuda.is_available():
+    path = model.export(format="engine", half=True, device=0, imgsz=imgsz, **batch)
+elif importlib.util.find_spec("openvino"):
+    calib = os.environ.get("POSE_CALIB_DATA", "coco8-pose.yaml")
+    path = model.export(format="openvino", int8=True, data=calib, imgsz=imgsz, **batch)
+else:
+    path = model.export(format="onnx", imgsz=imgsz, **batch)
+
+print(f"✅ Exported {weights} -> {path}")
@@ -3,16 +3,10 @@ RehabAI - Main entry point
 This file starts the FastAPI server.
 
 Run: uv run uvicorn main:app --reload --port 8000
-  OR: uv run python main.py
+  OR: uv run python main.py        (REHAB_RELOAD=1 for auto-reload)
 """
 
-import uvicorn
-from server import app  # import the FastAPI app from server.py
+from server import app, serve  # import the FastAPI app from server.py
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "server:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-    )
\ No newline at end of file
+    serve(port=8000)  # uvloop + httptools on Linux/macOS
\ No newline at end of file
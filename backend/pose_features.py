@@ -0,0 +1,94 @@
+"""
+RehabAI - Joint angles from COCO-17 pose keypoints
+
+track_angles() hooks them onto a YOLOPoseProcessor, so the coach can ask for
+measured angles (rehab_agent.py registers get_joint_angles) instead of
+estimating them from the video.
+"""
+import math
+import time
+
+import numpy as np
+
+# (joint, (a, b, c)) — the angle is measured at b, between b->a and b->c.
+# COCO indices: 5/6 shoulders, 7/8 elbows, 9/10 wrists, 11/12 hips, 13/14 knees, 15/16 ankles
+JOINT_TRIPLETS = {
+    "left_knee":      (11, 13, 15),
+    "right_knee":     (12, 14, 16),
+    "left_hip":       (5, 11, 13),
+    "right_hip":      (6, 12, 14),
+    "left_shoulder":  (7, 5, 11),
+    "right_shoulder": (8, 6, 12),
+    "left_elbow":     (5, 7, 9),
+    "right_elbow":    (6, 8, 10),
+}
+JOINTS = tuple(JOINT_TRIPLETS)
+_IDX = np.array(list(JOINT_TRIPLETS.values()))  # (joints, 3)
+
+
+def joint_angles(kpts, min_conf: float = 0.3) -> np.ndarray:
+    """Angles in degrees (0-180) for every joint in JOINTS, in one vectorized pass.
+
+    `kpts` is (17, 2|3) or batched (..., 17, 2|3) as (x, y[, confidence]).
+    Angles whose keypoints are below `min_conf` come back as NaN.
+    """
+    kpts = np.asarray(kpts, dtype=np.float32)
+    tri = kpts[..., _IDX, :]                  # (..., joints, 3 points, 2|3)
+    v1 = tri[..., 0, :2] - tri[..., 1, :2]
+    v2 = tri[..., 2, :2] - tri[..., 1, :2]
+    cross = v1[..., 0] * v2[..., 1] - v1[..., 1] * v2[..., 0]
+    dot = (v1 * v2).sum(axis=-1)
+    angles = np.degrees(np.abs(np.arctan2(cross, dot)))
+    if kpts.shape[-1] > 2:
+        angles[tri[..., 2].min(axis=-1) < min_conf] = np.nan
+    return angles
+
+
+def compute_angles(kpts, min_conf: float = 0.3) -> dict[str, float]:
+    """joint_angles() for a single person, keyed by joint name."""
+    return dict(zip(JOINTS, joint_angles(kpts, min_conf).tolist()))
+
+
+class AngleTracker:
+    """Joint angles of the most recent frame with a person in it.
+
+    Written from the pose processor's worker threads, read on the event loop;
+    `latest` is only ever swapped, never mutated.
+    """
+
+    def __init__(self):
+        self.latest: dict[str, int | None] = {}
+        self._updated_at = 0.0
+
+    def observe(self, pose_data: dict) -> None:
+        persons = pose_data.get("persons")
+        if not persons:
+            return
+        angles = compute_angles(persons[0]["keypoints"])
+        self.latest = {k: None if math.isnan(v) else round(v) for k, v in angles.items()}
+        self._updated_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        if not self.latest:
+            return {"detail": "no patient in view yet"}
+        return {
+            "angles_deg": self.latest,
+            "seconds_ago": round(time.monotonic() - self._updated_at, 1),
+        }
+
+
+def track_angles(processor) -> AngleTracker | None:
+    """Feed every pose the processor computes into a new AngleTracker. None if it can't be hooked."""
+    process = getattr(processor, "_process_pose_sync", None)
+    if process is None:
+        return None
+    tracker = AngleTracker()
+
+    def _process_and_track(frame_array):
+        annotated, pose_data = process(frame_array)
+        if pose_data:
+            tracker.observe(pose_data)
+        return annotated, pose_data
+
+    processor._process_pose_sync = _process_and_track
+    return tracker
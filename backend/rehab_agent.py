@@ -3,145 +3,593 @@ RehabAI - Real-time Physical Therapy Coach Agent
 """
 import os
 import asyncio
+import functools
+import importlib
+import importlib.util
+import inspect
+import json
+import logging
 import sys
 from pathlib import Path
-from dotenv import load_dotenv
-
-if sys.platform == "win32":
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-    import io
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
-
-load_dotenv(dotenv_path=Path(__file__).parent / ".env")
-
-INSTRUCTIONS = """
-You are REHAB AI — an expert real-time physical therapy coach. You speak with the calm,
-precise, and occasionally dry-humored voice of J.A.R.V.I.S from Iron Man.
-
-You watch patients perform rehabilitation exercises via their camera.
-Use this to give precise real-time voice coaching.
-
-## Supported Exercises
-1. KNEE_BEND         — Post knee surgery recovery (target: 90 degree knee flexion)
-2. SHOULDER_ROTATION — Shoulder rehabilitation (full 180 degree arc)
-3. HIP_ABDUCTION     — Hip replacement recovery (45 degree abduction)
-4. ANKLE_PUMP        — DVT prevention
-5. QUAD_SET          — Quadriceps strengthening
-6. SLR               — Straight leg raise (45 degree lift, knee straight)
-
-## Coaching Rules
-- Give feedback ONLY when you detect something worth saying
-- Keep responses SHORT (1-2 sentences max)
-- Count reps: "Rep 3 complete. Good control."
-- Correct form: "Left shoulder dropping. Keep both level."
-- Good form: "Perfect. Hold that position."
-- End of set: "Set complete. Rest 30 seconds."
-
-## Jarvis Tone
-- "Initiating analysis. Assume starting position when ready."
-- "Angle at 67 degrees. You need 90. Push deeper — there you go."
-- "I am detecting shoulder compensation. Keep your torso still."
-- "Excellent. That is your best repetition today."
-"""
 
+import _winfix  # noqa: F401  (Windows event loop + UTF-8 stdio)
 
-async def run_agent(call_id: str, call_type: str = "default", exercise: str = "general"):
-    from vision_agents.core import Agent, User
-    from vision_agents.plugins import getstream, deepgram, elevenlabs
+# Configured by server.py when hosted in-process, by __main__ below otherwise
+log = logging.getLogger("rehabai.agent")
+
+# When spawned by server.py the parsed .env is already in our environment
+if os.environ.get("REHAB_ENV_LOADED") != "1":
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=Path(__file__).parent / ".env")
+
+GEMINI_CANDIDATES = ["GeminiLLM", "Gemini", "GoogleLLM", "GoogleGeminiLLM"]
+
+# REHAB_DEBUG=1 enables the plugin / module-member dumps, which stat and walk
+# package directories — keep them off the normal session-start path
+DEBUG = os.environ.get("REHAB_DEBUG") == "1"
+
+# Per-process settings, read from the environment once (see _config)
+DEFAULTS = {
+    "STREAM_AGENT_ID":    "rehab-ai-agent",
+    "GEMINI_MODEL":       "gemini-2.5-flash",
+    "ANTHROPIC_MODEL":    "claude-haiku-4-5",
+    "DEEPGRAM_MODEL":     "nova-2",
+    "DEEPGRAM_ENDPOINTING_MS":   "300",   # silence that ends an utterance
+    "DEEPGRAM_UTTERANCE_END_MS": "1000",
+    "DEEPGRAM_TTS_MODEL": "aura-2-orion-en",
+    "YOLO_MODEL":         "yolo11n-pose.pt",
+    "REHAB_ENABLE_POSE":  "0",
+    "REHAB_POSE_DEVICE":  "auto",  # "auto" picks cuda:0 when torch sees a GPU
+    "REHAB_STREAM_TTS":   "1",     # speak LLM output sentence by sentence
+    "REHAB_BARGE_IN_MIN_CHARS":  "4",    # interim transcript needed to interrupt the coach
+    "REHAB_BARGE_IN_MIN_CONF":   "0.6",  # ...and its confidence, when STT reports one
+    "REHAB_POSE_BATCH":   "1",     # one batched pose model for all sessions in a process
+    "REHAB_POSE_IMGSZ":   "416",   # letterboxed input size; the patient fills most of the frame
+    "REHAB_POSE_MAX_DET": "2",     # patient + at most one helper in view
+    "REHAB_POSE_MOTION_EPS": "2.0",  # skip pose on frames this still (mean luma diff); 0 = off
+}
+
+# Socket a long-lived `rehab_agent.py --worker` process listens on for jobs
+WORKER_SOCKET = os.environ.get("REHAB_AGENT_SOCKET", "/tmp/rehab-agent.sock")
+# Sessions one worker runs at once; jobs beyond it are rejected (server.py answers 429)
+WORKER_MAX_SESSIONS = int(os.environ.get("MAX_AGENTS") or os.environ.get("MAX_SESSIONS", "8"))
+
+INSTRUCTIONS = (Path(__file__).parent / "prompts" / "coach.md").read_text(encoding="utf-8")
+
+# Everything before the exercise name is byte-identical on every session, so the
+# provider-side prompt prefix cache (Anthropic / Gemini) can hit on it.
+_INSTRUCTIONS_FROZEN = INSTRUCTIONS.strip() + "\n\nCurrent exercise: "
+
+
+@functools.lru_cache(maxsize=1)
+def _config() -> dict:
+    env = os.environ
+    return {k: env.get(k, d) for k, d in DEFAULTS.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def _plugin(name: str):
+    """Import vision_agents.plugins.<name> on first use — each plugin drags in its own SDK."""
+    return importlib.import_module(f"vision_agents.plugins.{name}")
+
+
+def _has_plugin(name: str) -> bool:
+    # find_spec only locates the module — it does not execute it
+    return importlib.util.find_spec(f"vision_agents.plugins.{name}") is not None
 
-    agent_id    = os.environ.get("STREAM_AGENT_ID", "rehab-ai-agent")
-    api_key     = os.environ["STREAM_API_KEY"]
-    api_secret  = os.environ["STREAM_API_SECRET"]
-    agent_token = os.environ.get("STREAM_AGENT_TOKEN")
 
+def _debug_members(mod) -> None:
+    if DEBUG:
+        log.info("[Agent] %s members: %s", mod.__name__, [x for x in dir(mod) if not x.startswith("_")])
+
+
+@functools.lru_cache(maxsize=1)
+def _get_stream_client(api_key: str, api_secret: str):
+    # One client (and its HTTP connection pool) per process, shared by every session
     from getstream import AsyncStream
-    stream_client = AsyncStream(api_key=api_key, api_secret=api_secret)
-    if agent_token:
-        stream_client.token = agent_token
-        print(f"[Agent] Authenticated as '{agent_id}'")
+    return AsyncStream(api_key=api_key, api_secret=api_secret)
+
+
+@functools.lru_cache(maxsize=1)
+def _shared_http():
+    """One pooled httpx client for the provider SDKs (Anthropic, ElevenLabs, Deepgram).
+
+    Sessions reuse its kept-alive TLS connections instead of each SDK client
+    opening its own. Plugins close their SDK client when a session ends, so
+    aclose() is a no-op here; _close_shared_http() really closes it.
+    """
+    import httpx
+
+    class SharedAsyncClient(httpx.AsyncClient):
+        async def aclose(self) -> None:
+            pass
+
+        async def close_for_real(self) -> None:
+            await super().aclose()
+
+    return SharedAsyncClient(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=60),
+        timeout=httpx.Timeout(30.0, connect=10.0),
+    )
+
+
+async def _close_shared_http() -> None:
+    if _shared_http.cache_info().currsize:
+        await _shared_http().close_for_real()
+
+
+def _with_sdk_client(plugin_cls, factory, **kwargs):
+    """Construct `plugin_cls`, handing it an SDK client on the shared pool if it takes one."""
+    try:
+        if "client" in inspect.signature(plugin_cls).parameters:
+            kwargs["client"] = factory(_shared_http())
+    except Exception as e:
+        log.info(f"[Agent] {plugin_cls.__module__} keeps its own HTTP client ({e})")
+    return plugin_cls(**kwargs)
 
-    # Edge
-    edge = getstream.Edge()
+
+def _anthropic_client(http):
+    import anthropic
+    return anthropic.AsyncAnthropic(http_client=http)
+
+
+def _elevenlabs_client(http):
+    from elevenlabs.client import AsyncElevenLabs
+    return AsyncElevenLabs(httpx_client=http)
+
+
+def _deepgram_client(http):
+    from deepgram import AsyncDeepgramClient
+    return AsyncDeepgramClient(httpx_client=http)
+
+
+def _find_edge(stream_client):
+    # vision-agents >= 0.3.8 (see pyproject) always ships the getstream edge plugin
+    edge = _plugin("getstream").Edge()
     edge.client = stream_client
+    return edge
 
-    # LLM — try Gemini first, fallback to Anthropic
-    llm = None
+
+@functools.lru_cache(maxsize=1)
+def _find_llm_classes() -> tuple:
+    """Return ((LLM class, model, label), ...) in preference order. Resolved once per process."""
     google_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
     anthropic_key = os.environ.get("ANTHROPIC_API_KEY")
+    found = []
 
+    # LLM — try Gemini first, fallback to Anthropic
     if google_key:
         try:
-            from vision_agents.core import llm as llm_mod
-            # Try different Gemini class names
-            for cls_name in ["GeminiLLM", "Gemini", "GoogleLLM", "GoogleGeminiLLM"]:
-                cls = getattr(llm_mod, cls_name, None)
-                if cls:
-                    model = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
-                    llm = cls(model=model)
-                    print(f"[Agent] LLM: {cls_name} ({model})")
-                    break
+            model = _config()["GEMINI_MODEL"]
+            if _has_plugin("gemini"):
+                found.append((_plugin("gemini").LLM, model, f"gemini {model}"))
+            else:
+                from vision_agents.core import llm as llm_mod
+                for cls_name in GEMINI_CANDIDATES:
+                    cls = getattr(llm_mod, cls_name, None)
+                    if cls:
+                        found.append((cls, model, f"{cls_name} ({model})"))
+                        break
+                else:
+                    _debug_members(llm_mod)
+        except Exception as e:
+            log.error(f"[Agent] Gemini failed: {e}")
+
+    if anthropic_key:
+        try:
+            model = _config()["ANTHROPIC_MODEL"]
+            # partial: the SDK client is built per session, the pool behind it is shared
+            cls = functools.partial(_with_sdk_client, _plugin("anthropic").LLM, _anthropic_client)
+            found.append((cls, model, f"anthropic {model}"))
         except Exception as e:
-            print(f"[Agent] Gemini failed: {e}")
+            log.error(f"[Agent] Anthropic failed: {e}")
 
-    if llm is None and anthropic_key:
+    return tuple(found)
+
+
+def _find_llm():
+    for cls, model, label in _find_llm_classes():
         try:
-            from vision_agents.plugins import anthropic as anthropic_plugin
-            model = os.environ.get("ANTHROPIC_MODEL", "claude-haiku-4-5")
-            llm = anthropic_plugin.LLM(model=model)
-            print(f"[Agent] LLM: anthropic {model}")
+            llm = cls(model=model)
         except Exception as e:
-            print(f"[Agent] Anthropic failed: {e}")
+            log.error(f"[Agent] {label} failed: {e}")
+            continue
+        log.info(f"[Agent] LLM: {label}")
+        return llm
+
+    raise RuntimeError("No LLM available! Set GOOGLE_API_KEY or ANTHROPIC_API_KEY")
+
 
-    if llm is None:
-        raise RuntimeError("No LLM available! Set GOOGLE_API_KEY or ANTHROPIC_API_KEY")
+def _get_stt():
+    cfg = _config()
+    stt_model = cfg["DEEPGRAM_MODEL"]
+    deepgram = _plugin("deepgram")
+    # Finals ~300 ms after the patient stops talking instead of Deepgram's default
+    # buffering. Audio format is left to the plugin: it decodes the WebRTC track.
+    low_latency = {
+        "interim_results":  True,
+        "endpointing":      int(cfg["DEEPGRAM_ENDPOINTING_MS"]),
+        "utterance_end_ms": int(cfg["DEEPGRAM_UTTERANCE_END_MS"]),
+        "no_delay":         True,
+    }
+    try:
+        stt = deepgram.STT(model=stt_model, **low_latency)
+    except TypeError:
+        # Plugin version without pass-through live options
+        stt = deepgram.STT(model=stt_model)
+        log.warning("[Agent] deepgram.STT ignores low-latency options, using defaults")
+    log.info(f"[Agent] STT: deepgram {stt_model}")
+    return stt
 
-    # STT
-    stt_model = os.environ.get("DEEPGRAM_MODEL", "nova-2")
-    stt = deepgram.STT(model=stt_model)
-    print(f"[Agent] STT: deepgram {stt_model}")
 
-    # TTS
+def _get_tts():
     try:
-        tts = elevenlabs.TTS()
-        print("[Agent] TTS: elevenlabs")
+        tts = _with_sdk_client(_plugin("elevenlabs").TTS, _elevenlabs_client)
+        log.info("[Agent] TTS: elevenlabs")
     except Exception as e:
-        print(f"[Agent] elevenlabs failed ({e}), using deepgram")
-        tts = deepgram.TTS(model=os.environ.get("DEEPGRAM_TTS_MODEL", "aura-2-orion-en"))
-        print("[Agent] TTS: deepgram")
+        log.error(f"[Agent] elevenlabs failed ({e}), using deepgram")
+        tts = _with_sdk_client(_plugin("deepgram").TTS, _deepgram_client,
+                               model=_config()["DEEPGRAM_TTS_MODEL"])
+        log.info("[Agent] TTS: deepgram")
+    return tts
 
-    agent = Agent(
-        edge=edge,
-        agent_user=User(name="REHAB AI", id=agent_id),
-        instructions=INSTRUCTIONS + f"\n\nCurrent exercise: {exercise}",
-        llm=llm,
-        stt=stt,
-        tts=tts,
+
+_pinned_weights: list = []  # mmaps a worker keeps open for its whole lifetime
+
+
+def _pin_pose_weights() -> None:
+    """Map the pose weights read-only and ask the kernel to keep them in the page cache.
+
+    Only useful with REHAB_POSE_BATCH=0, where every session loads the weights
+    itself: they are then read from memory instead of disk. An OpenVINO export
+    is a directory; its files are pinned one by one.
+    """
+    path = Path(_pose_backend()[0])
+    files = sorted(p for p in path.iterdir() if p.is_file()) if path.is_dir() else [path]
+    files = [f for f in files if f.is_file() and f.stat().st_size]
+    if not files:
+        log.info(f"[Worker] Nothing to pin at {path} (ultralytics downloads it on first use)")
+        return
+    import mmap
+    for file in files:
+        with open(file, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            mm.madvise(mmap.MADV_WILLNEED)
+        _pinned_weights.append(mm)
+    size = sum(len(mm) for mm in _pinned_weights[-len(files):])
+    log.info(f"[Worker] Pinned {path} ({size // 1024} KiB) in page cache")
+
+
+@functools.lru_cache(maxsize=1)
+def _pose_backend() -> tuple[str, str, int]:
+    """Pick (model_path, device, fps) for the pose processor. Resolved once per process.
+
+    On CUDA, a TensorRT engine exported next to the weights (export_pose_model.py)
+    is preferred; on CPU, an INT8 OpenVINO export, then ONNX. Everything falls back
+    to the .pt file.
+    """
+    weights = Path(_config()["YOLO_MODEL"])
+    device = _config()["REHAB_POSE_DEVICE"]
+    if device == "auto":
+        import torch
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    if device.startswith("cuda"):
+        exported, fps = [weights.with_suffix(".engine")], 15
+    else:
+        exported, fps = [
+            weights.with_name(f"{weights.stem}_int8_openvino_model"),
+            weights.with_suffix(".onnx"),
+        ], 1
+    model_path = next((str(p) for p in exported if p.exists()), str(weights))
+    return model_path, device, fps
+
+
+def _get_processors() -> list:
+    # Pose tracking pulls in ultralytics + torch; only pay for it when asked to
+    if _config()["REHAB_ENABLE_POSE"] != "1":
+        return []
+    import yolo_service
+    model_path, device, fps = _pose_backend()
+    predict_args = {
+        "imgsz":   int(_config()["REHAB_POSE_IMGSZ"]),
+        "max_det": int(_config()["REHAB_POSE_MAX_DET"]),
+    }
+    cls = _plugin("ultralytics").YOLOPoseProcessor
+    kwargs = {"model_path": model_path, "device": device, "conf_threshold": 0.5, "fps": fps}
+    if _config()["REHAB_POSE_BATCH"] == "1":
+        # The weights load once per process; predict options live on that shared model
+        processor = yolo_service.shared_processor(cls, predict_args=predict_args, **kwargs)
+        log.info("[Agent] Pose inference batched through the shared model")
+    else:
+        try:
+            processor = cls(**kwargs, **predict_args)
+        except TypeError:
+            # Older YOLOPoseProcessor doesn't forward predict options; set them on its model
+            processor = cls(**kwargs)
+            yolo_service.set_predict_defaults(processor, **predict_args)
+    log.info(f"[Agent] Processor: YOLOPoseProcessor ({model_path} on {device}, {fps} fps)")
+    motion_eps = float(_config()["REHAB_POSE_MOTION_EPS"])
+    if motion_eps > 0 and yolo_service.gate_motion(processor, motion_eps):
+        log.info(f"[Agent] Pose skipped on still frames (motion < {motion_eps})")
+    return [processor]
+
+
+def _list_plugins() -> list[str]:
+    import pkgutil
+    import vision_agents.plugins as _p
+    return sorted(m.name for m in pkgutil.iter_modules(_p.__path__))
+
+
+def _register_pose_tools(llm, processor) -> None:
+    """Give the coach measured joint angles from the pose processor as a tool."""
+    import pose_features
+    tracker = pose_features.track_angles(processor)
+    if tracker is None or not hasattr(llm, "register_function"):
+        return
+
+    @llm.register_function(
+        description="The patient's current knee, hip, shoulder and elbow angles in degrees, "
+                    "measured from the camera (180 = fully straight; null = joint not visible)",
     )
+    async def get_joint_angles() -> dict:
+        return tracker.snapshot()
+
+    log.info("[Agent] Joint angles available to the coach (get_joint_angles)")
+
+
+def _stream_llm_into_tts(agent, tts) -> None:
+    """Start speaking each sentence as soon as the LLM has produced it."""
+    from speech import SentenceStreamer
+
+    streamer = SentenceStreamer(tts.send)
+    # The pipeline still hands the complete response to tts.send(); the streamer
+    # only speaks whatever the streamed deltas have not already queued.
+    tts.send = streamer.send
+    try:
+        from vision_agents.core.llm.events import LLMResponseChunkEvent
+        from vision_agents.core.stt.events import STTPartialTranscriptEvent
+    except ImportError as e:
+        log.warning(f"[Agent] LLM chunk events unavailable ({e}), splitting TTS per sentence only")
+        return
+
+    @agent.events.subscribe
+    async def _on_llm_chunk(event: LLMResponseChunkEvent):
+        await streamer.feed(getattr(event, "delta", None) or "")
+
+    min_chars = int(_config()["REHAB_BARGE_IN_MIN_CHARS"])
+    min_conf = float(_config()["REHAB_BARGE_IN_MIN_CONF"])
+
+    @agent.events.subscribe
+    async def _on_barge_in(event: STTPartialTranscriptEvent):
+        # Interim results fire on breathing and clatter too — only actual words
+        # from the patient cut the coach off
+        text = (getattr(event, "text", None) or "").strip()
+        confidence = getattr(event, "confidence", None)
+        if len(text) < min_chars or (confidence is not None and confidence < min_conf):
+            return
+        streamer.cancel()
+
+    log.info("[Agent] Streaming LLM -> TTS per sentence")
+
+
+async def _warm_connections(*components) -> None:
+    """Let each component open its provider connection (TLS, websocket) ahead of use."""
+    async def warm(component):
+        warmup = getattr(component, "warmup", None)
+        if warmup is None:
+            return
+        try:
+            result = warmup()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            log.error(f"[Agent] {type(component).__name__} warmup failed: {e}")
+
+    await asyncio.gather(*(warm(c) for c in components))
+
+
+async def _build_components(stream_client):
+    """Construct edge, LLM, STT, TTS and processors, overlapping the slow pose-model load."""
+    loop = asyncio.get_running_loop()
+    # YOLO weight loading is blocking disk + torch work: hand it to a thread right
+    # away. The network clients stay on the loop since they may bind to it.
+    processors = loop.run_in_executor(None, _get_processors)
+
+    edge = _find_edge(stream_client)
+    llm = _find_llm()
+    stt = _get_stt()
+    tts = _get_tts()
+
+    return edge, llm, stt, tts, await processors
+
+
+async def run_agent(
+    call_id: str,
+    call_type: str = "default",
+    exercise: str = "general",
+    agent_token: str | None = None,
+    join_delay: float = 0,
+):
+    """Coach one call. `join_delay` is how long the patient needs to join it — the
+    agent builds its components and warms their connections in the meantime."""
+    # The patient starts joining now, so everything up to create_call overlaps it
+    join_timer = asyncio.create_task(asyncio.sleep(join_delay))
+    try:
+        agent, llm, stt, tts = await _assemble_agent(exercise, agent_token)
+        # Handshakes with the LLM/STT/TTS providers overlap the patient joining
+        # too, so the greeting does not pay for them
+        await asyncio.gather(_warm_connections(llm, stt, tts), join_timer)
+    finally:
+        join_timer.cancel()  # no-op once it has finished
 
-    print(f"[Agent] Joining {call_type}:{call_id}...")
+    log.info(f"[Agent] Joining {call_type}:{call_id}...")
     call = await agent.create_call(call_type, call_id)
 
     async with agent.join(call):
-        print("[Agent] Joined! Sending greeting...")
+        log.info("[Agent] Joined! Sending greeting...")
         await agent.simple_response(
             f"REHAB AI online. {exercise.replace('_', ' ').title()} protocol loaded. "
             "Initiating analysis. Assume starting position when ready."
         )
-        print("[Agent] Monitoring session...")
+        log.info("[Agent] Monitoring session...")
         await agent.finish()
 
-    print("[Agent] Session complete.")
+    log.info("[Agent] Session complete.")
+
+
+async def _assemble_agent(exercise: str, agent_token: str | None):
+    """Build the Agent and its components: (agent, llm, stt, tts)."""
+    from vision_agents.core import Agent, User
+
+    agent_id    = _config()["STREAM_AGENT_ID"]
+    api_key     = os.environ["STREAM_API_KEY"]
+    api_secret  = os.environ["STREAM_API_SECRET"]
+    agent_token = agent_token or os.environ.get("STREAM_AGENT_TOKEN")
+
+    if DEBUG:
+        log.info("[Agent] Available plugins: %s", _list_plugins())
+
+    stream_client = _get_stream_client(api_key, api_secret)
+    if agent_token:
+        stream_client.token = agent_token
+        log.info(f"[Agent] Authenticated as '{agent_id}'")
+
+    edge, llm, stt, tts, processors = await _build_components(stream_client)
+
+    agent = Agent(
+        edge=edge,
+        agent_user=User(name="REHAB AI", id=agent_id),
+        instructions=_INSTRUCTIONS_FROZEN + exercise,
+        llm=llm,
+        stt=stt,
+        tts=tts,
+        processors=processors,
+    )
+    if processors:
+        _register_pose_tools(llm, processors[0])
+    if _config()["REHAB_STREAM_TTS"] == "1":
+        _stream_llm_into_tts(agent, tts)
+    return agent, llm, stt, tts
+
+
+# ---------------------------------------------------------------------------
+# Long-lived hosts — worker mode here, or in-process in server.py
+# ---------------------------------------------------------------------------
+def warm_up() -> None:
+    """Import the agent stack once so each session only has to construct clients.
+
+    Called by `--worker` mode and by server.py when it hosts sessions in-process.
+    """
+    import vision_agents.core  # noqa: F401
+    names = ["getstream", "deepgram", "elevenlabs"]
+    if os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY"):
+        names.append("gemini")
+    elif os.environ.get("ANTHROPIC_API_KEY"):
+        names.append("anthropic")
+    if _config()["REHAB_ENABLE_POSE"] == "1":
+        names.append("ultralytics")
+        if _config()["REHAB_POSE_BATCH"] != "1":
+            _pin_pose_weights()  # otherwise the weights are loaded once, by the shared batcher
+    for name in names:
+        if _has_plugin(name):
+            _plugin(name)
+    _find_llm_classes()
+
+
+async def _run_agent_job(job: dict) -> None:
+    """run_agent() for one job dict, as sent over a worker socket or on --stdin."""
+    await run_agent(
+        job["call_id"],
+        job.get("call_type", "default"),
+        job.get("exercise", "general"),
+        agent_token=job.get("agent_token"),
+        join_delay=float(job.get("join_delay", 0)),
+    )
+
+
+async def _run_job(job: dict) -> None:
+    try:
+        await _run_agent_job(job)
+    except Exception as e:
+        log.exception(f"[Worker] Session {job['call_id']} failed: {e}")
+
+
+async def worker_main(socket_path: str = WORKER_SOCKET) -> None:
+    """Accept newline-delimited JSON jobs on a Unix socket, one session task per job."""
+    warm_up()
+    sessions: set[asyncio.Task] = set()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            job = json.loads(await reader.readline())
+            if len(sessions) >= WORKER_MAX_SESSIONS:
+                log.warning(f"[Worker] Rejected call_id={job['call_id']}: {len(sessions)} sessions active")
+                writer.write(b'{"status": "rejected", "detail": "agent capacity full"}\n')
+            else:
+                task = asyncio.create_task(_run_job(job))
+                sessions.add(task)
+                task.add_done_callback(sessions.discard)
+                log.info(f"[Worker] Accepted call_id={job['call_id']} ({len(sessions)} active)")
+                writer.write(b'{"status": "accepted"}\n')
+        except (ValueError, KeyError, TypeError) as e:
+            writer.write(json.dumps({"status": "rejected", "detail": str(e)}).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+    Path(socket_path).unlink(missing_ok=True)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    log.info(f"[Worker] Listening on {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+async def _run_once(job: dict) -> None:
+    try:
+        await _run_agent_job(job)
+    finally:
+        await _close_shared_http()
+
+
+def _run(main) -> None:
+    """asyncio.run, on uvloop where it is available (POSIX — ships with uvicorn[standard])."""
+    if sys.platform != "win32":
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            return uvloop.run(main)
+    return asyncio.run(main)
 
 
 if __name__ == "__main__":
-    call_id   = os.environ.get("CALL_ID")
-    call_type = os.environ.get("CALL_TYPE", "default")
-    exercise  = os.environ.get("EXERCISE", "general")
+    from _logsetup import setup_logging
+
+    if "--worker" in sys.argv:
+        setup_logging(prefix=os.environ.get("REHAB_LOG_PREFIX", ""))
+        if sys.platform == "win32":
+            log.error("ERROR: worker mode needs Unix sockets and is not supported on Windows")
+            exit(1)
+        _run(worker_main())
+        exit(0)
+
+    if "--stdin" in sys.argv:
+        # server.py sends the job as one JSON line (same shape as a --worker job)
+        job = json.loads(sys.stdin.readline() or "{}")
+    else:
+        job = {
+            "call_id":    os.environ.get("CALL_ID"),
+            "call_type":  os.environ.get("CALL_TYPE", "default"),
+            "exercise":   os.environ.get("EXERCISE", "general"),
+            "join_delay": os.environ.get("JOIN_DELAY", "0"),
+        }
 
-    if not call_id:
-        print("ERROR: CALL_ID env var is required")
+    # Our stdout is the server's own: tag lines here instead of having it relay them
+    setup_logging(prefix=f"[AGENT {job.get('call_id')}] " if "--stdin" in sys.argv else "")
+    if not job.get("call_id"):
+        log.error("ERROR: CALL_ID env var (or a job on stdin with --stdin) is required")
         exit(1)
 
-    print(f"[RehabAI Agent] Starting — call_id={call_id} exercise={exercise}")
-    asyncio.run(run_agent(call_id, call_type, exercise))
\ No newline at end of file
+    log.info(f"[RehabAI Agent] Starting — call_id={job['call_id']} exercise={job.get('exercise')}")
+    _run(_run_once(job))
\ No newline at end of file
@@ -4,70 +4,237 @@ RehabAI Backend API Server
 import os
 import sys
 import asyncio
-import threading
-import subprocess
 import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
+import jwt
+import orjson
 from dotenv import load_dotenv
 
+import _winfix  # noqa: F401  (Windows event loop + UTF-8 stdio)
+from _logsetup import setup_logging
+from agent_pool import AGENT_SCRIPT, AgentPool
+
 load_dotenv(dotenv_path=Path(__file__).parent / ".env")
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from stream_chat import StreamChat
 
-app = FastAPI(title="RehabAI Backend", version="1.0.0")
+log = setup_logging()
+
+AGENT_USER_ID = "rehab-ai-agent"
+
+# "inprocess":  run sessions as tasks on this server's event loop (default)
+# "worker":     hand sessions to a running `rehab_agent.py --worker` over its Unix socket
+# "pool":       start AGENT_POOL_SIZE such workers with the server, round-robin over them
+# "subprocess": spawn rehab_agent.py per session
+AGENT_MODE   = os.environ.get("AGENT_MODE", "inprocess")
+AGENT_SOCKET = os.environ.get("REHAB_AGENT_SOCKET", "/tmp/rehab-agent.sock")
+AGENT_POOL_SIZE = int(os.environ.get("AGENT_POOL_SIZE", "2"))
+JOIN_DELAY   = 4  # seconds for the patient to fully join the call; the agent starts up meanwhile
+WORKER_REPLY_TIMEOUT = 5  # seconds for an agent worker to answer a job before we move on
+# Agent sessions this server hosts at once, in-process or as its own subprocesses.
+# A `--worker` process reads the same variable as its own per-process cap.
+MAX_SESSIONS = int(os.environ.get("MAX_AGENTS") or os.environ.get("MAX_SESSIONS", "8"))
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "64"))  # in-flight HTTP requests
+TOKEN_TTL    = int(os.environ.get("STREAM_TOKEN_TTL", "0"))  # seconds; 0 = tokens never expire
+STREAM_POOL_SIZE = int(os.environ.get("STREAM_POOL_SIZE", "50"))  # kept-alive Stream API connections
+
+# Environment every agent subprocess starts with. The per-call job goes over its
+# stdin instead, which keeps the agent token out of the process environment.
+_BASE_ENV = {
+    **os.environ,
+    "STREAM_AGENT_ID":  AGENT_USER_ID,
+    "REHAB_ENV_LOADED": "1",  # .env already parsed above, skip it in the child
+}
+
+_background_tasks: set[asyncio.Task] = set()
+# Patients already upserted to Stream by this process, least recently seen first.
+# user_id comes straight from the query string, so this is bounded.
+_known_users: OrderedDict[str, None] = OrderedDict()
+KNOWN_USERS_MAX = 10_000
+
+UPSERT_WINDOW = 0.02   # seconds new patients wait to share one upsert_users call
+UPSERT_BATCH_MAX = 100  # Stream's limit per upsert_users call
+_pending_upserts: dict[str, dict] = {}
+_upsert_flush: asyncio.Task | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.sessions = {}
+    app.state.agent_token = None
+    app.state.pool = None
+    app.state.active_sessions = 0  # sessions hosted here, counted against MAX_SESSIONS
+
+    # Every route needs Stream: refuse to boot without it rather than 500 per request
+    key    = os.environ.get("STREAM_API_KEY")
+    secret = os.environ.get("STREAM_API_SECRET")
+    if not key or not secret:
+        raise RuntimeError("STREAM_API_KEY and STREAM_API_SECRET must be set (see backend/.env)")
+    app.state.stream = (key, secret)
+    app.state.chat = _make_chat_client(key, secret)
+
+    # The agent user is upserted once here instead of on every /token
+    try:
+        app.state.agent_token = await asyncio.to_thread(_agent_token, app.state.chat, secret)
+        log.info(f"[RehabAI] ✅ Agent user '{AGENT_USER_ID}' ready")
+    except Exception as e:
+        log.error(f"[RehabAI] ❌ Agent user upsert failed, retrying on /start-agent: {e}")
+    if AGENT_MODE == "inprocess":
+        import rehab_agent
+        # vision_agents, the plugins and (with REHAB_ENABLE_POSE) the YOLO weights
+        # load once here instead of once per session
+        await asyncio.to_thread(rehab_agent.warm_up)
+        log.info(f"[RehabAI] ✅ Agent stack loaded (in-process, max {MAX_SESSIONS} sessions)")
+    elif AGENT_MODE == "pool":
+        if sys.platform == "win32":
+            log.error("[RehabAI] ❌ Worker pool needs Unix sockets, using subprocess mode")
+        else:
+            # Per server process: with several uvicorn workers each starts its own pool
+            app.state.pool = AgentPool(AGENT_POOL_SIZE, f"{AGENT_SOCKET}.{os.getpid()}")
+            await app.state.pool.start()
+    yield
+    # Cancelling a session leaves its call (agent.join is a context manager)
+    # rather than abandoning it mid-session when the process goes away
+    sessions = list(app.state.sessions.values())
+    if sessions:
+        log.info(f"[RehabAI] Ending {len(sessions)} agent session(s)")
+        for task in sessions:
+            task.cancel()
+        await asyncio.gather(*sessions, return_exceptions=True)
+    if app.state.pool is not None:
+        await app.state.pool.stop()
+
+
+app = FastAPI(title="RehabAI Backend", version="1.0.0",
+              default_response_class=ORJSONResponse, lifespan=lifespan)
+
 
+class ConcurrencyLimitMiddleware:
+    """Answer 503 + Retry-After once `limit` requests are in flight (/health is exempt)."""
+
+    def __init__(self, app, limit: int = MAX_CONCURRENCY):
+        self.app = app
+        self._sem = asyncio.Semaphore(limit)
+        self._busy = ORJSONResponse({"detail": "busy"}, status_code=503, headers={"Retry-After": "1"})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/health":
+            return await self.app(scope, receive, send)
+        if self._sem.locked():
+            return await self._busy(scope, receive, send)
+        async with self._sem:
+            await self.app(scope, receive, send)
+
+
+# Added before CORS so it runs inside it: the 503s get CORS headers too
+app.add_middleware(ConcurrencyLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins for now
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Explicit lists are answered with fixed strings instead of echoing the
+    # request's, and browsers may cache the preflight for a day
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
 
-AGENT_USER_ID = "rehab-ai-agent"
 
+def _make_chat_client(key: str, secret: str) -> StreamChat:
+    # One per process, on app.state.chat
+    chat = StreamChat(api_key=key, api_secret=secret)
+    session = getattr(chat, "session", None)
+    if session is not None:
+        # Upserts run from asyncio.to_thread workers: give each of them a kept-alive
+        # connection instead of requests' default pool of 10
+        from requests.adapters import HTTPAdapter
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=STREAM_POOL_SIZE, max_retries=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return chat
 
-def _get_chat_client() -> StreamChat:
-    key = os.environ.get("STREAM_API_KEY")
-    secret = os.environ.get("STREAM_API_SECRET")
-    if not key or not secret:
-        raise HTTPException(status_code=500, detail="STREAM keys missing")
-    return StreamChat(api_key=key, api_secret=secret)
+
+def _make_token(user_id: str, secret: str, expires_at: float | None = None) -> str:
+    """A Stream user token: what StreamChat.create_token signs, minus the SDK."""
+    claims = {"user_id": user_id}
+    if expires_at is not None:
+        claims["exp"] = int(expires_at)
+    return jwt.encode(claims, secret, algorithm="HS256")
+
+
+def _agent_token(chat: StreamChat, secret: str) -> str:
+    # Blocking (upsert is an HTTPS call) — run via asyncio.to_thread
+    chat.upsert_user({"id": AGENT_USER_ID, "name": "REHAB AI", "role": "admin"})
+    return _make_token(AGENT_USER_ID, secret)
+
+
+# The environment doesn't change after startup, so neither does /health
+_HEALTH_BODY = orjson.dumps({
+    "status": "ok",
+    "env": {
+        k: ("SET" if os.environ.get(k) else "MISSING")
+        for k in [
+            "STREAM_API_KEY", "STREAM_API_SECRET",
+            "GOOGLE_API_KEY", "ELEVENLABS_API_KEY",
+            "DEEPGRAM_API_KEY", "ANTHROPIC_API_KEY",
+        ]
+    },
+})
 
 
 @app.get("/health")
 async def health():
-    return {
-        "status": "ok",
-        "env": {
-            k: ("SET" if os.environ.get(k) else "MISSING")
-            for k in [
-                "STREAM_API_KEY", "STREAM_API_SECRET",
-                "GOOGLE_API_KEY", "ELEVENLABS_API_KEY",
-                "DEEPGRAM_API_KEY", "ANTHROPIC_API_KEY",
-            ]
-        },
-    }
+    return Response(_HEALTH_BODY, media_type="application/json")
 
 
 @app.get("/token")
 async def get_token(user_id: str = "patient-001"):
-    try:
-        chat = _get_chat_client()
-        chat.upsert_users([
-            {"id": user_id,       "name": "Patient",  "role": "user"},
-            {"id": AGENT_USER_ID, "name": "REHAB AI", "role": "admin"},
-        ])
-        token = chat.create_token(user_id)
-        print(f"[RehabAI] ✅ Token issued for user '{user_id}'")
-        return {"token": token, "api_key": os.environ["STREAM_API_KEY"]}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    key, secret = app.state.stream
+    if user_id in _known_users:
+        _known_users.move_to_end(user_id)
+    else:
+        # The client doesn't need the user to exist yet to use its token, so
+        # don't make it wait for the upsert round-trip
+        _known_users[user_id] = None
+        if len(_known_users) > KNOWN_USERS_MAX:
+            _known_users.popitem(last=False)  # at worst upserted again later
+        _queue_upsert(user_id)
+    expires_at = time.time() + TOKEN_TTL if TOKEN_TTL else None
+    token = _make_token(user_id, secret, expires_at)
+    log.info(f"[RehabAI] ✅ Token issued for user '{user_id}'")
+    return {"token": token, "api_key": key}
+
+
+def _queue_upsert(user_id: str) -> None:
+    global _upsert_flush
+    _pending_upserts[user_id] = {"id": user_id, "name": "Patient", "role": "user"}
+    if _upsert_flush is None:
+        _upsert_flush = asyncio.create_task(_flush_upserts())
+        _background_tasks.add(_upsert_flush)
+        _upsert_flush.add_done_callback(_background_tasks.discard)
+
+
+async def _flush_upserts():
+    """Upsert every patient queued within UPSERT_WINDOW in as few calls as possible."""
+    global _upsert_flush
+    await asyncio.sleep(UPSERT_WINDOW)
+    users = list(_pending_upserts.values())
+    _pending_upserts.clear()
+    _upsert_flush = None  # patients arriving from now on start the next batch
+    for i in range(0, len(users), UPSERT_BATCH_MAX):
+        batch = users[i:i + UPSERT_BATCH_MAX]
+        try:
+            await asyncio.to_thread(app.state.chat.upsert_users, batch)
+        except Exception as e:
+            for user in batch:
+                _known_users.pop(user["id"], None)  # try again on the next /token
+            log.error(f"[RehabAI] ❌ Upsert failed for {len(batch)} user(s): {e}")
 
 
 class StartAgentRequest(BaseModel):
@@ -77,68 +244,196 @@ class StartAgentRequest(BaseModel):
 
 @app.post("/start-agent")
 async def start_agent(req: StartAgentRequest):
-    key    = os.environ.get("STREAM_API_KEY")
-    secret = os.environ.get("STREAM_API_SECRET")
-    if not key or not secret:
-        raise HTTPException(status_code=500, detail="Stream keys missing")
+    agent_token = app.state.agent_token
+    if agent_token is None:
+        # Startup couldn't reach Stream; try again now
+        try:
+            agent_token = app.state.agent_token = await asyncio.to_thread(
+                _agent_token, app.state.chat, app.state.stream[1],
+            )
+            log.info(f"[RehabAI] ✅ Agent token ready for '{AGENT_USER_ID}'")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Stream setup failed: {e}")
+
+    sessions = app.state.sessions
+    if AGENT_MODE == "inprocess" and req.call_id in sessions:
+        return {"status": "agent_running", "call_id": req.call_id}
+
+    # Workers cap their own sessions and reject jobs beyond it; sessions hosted
+    # here share one cap. Refuse rather than queue: a patient would rather retry
+    # than wait unseen. The slot is taken before any await, so a burst can't overshoot it.
+    to_workers = AGENT_MODE == "worker" or app.state.pool is not None
+    if not to_workers and not _reserve_slot():
+        raise HTTPException(status_code=429, detail="agent capacity full")
+
+    log.info(f"\n{'='*50}")
+    log.info(f"[RehabAI] Starting agent: call_id={req.call_id} exercise={req.exercise}")
+
+    if AGENT_MODE == "inprocess":
+        sessions[req.call_id] = asyncio.create_task(
+            _run_session(req.call_id, req.exercise, agent_token)
+        )
+    elif to_workers:
+        sockets = [AGENT_SOCKET] if AGENT_MODE == "worker" else app.state.pool.live_sockets()
+        outcome = await _dispatch_to_workers(sockets, _job(req.call_id, req.exercise, agent_token))
+        if outcome == "full":
+            raise HTTPException(status_code=429, detail="agent capacity full")
+        if outcome == "unavailable":
+            if not _reserve_slot():
+                raise HTTPException(status_code=429, detail="agent capacity full")
+            log.error("[RehabAI] ❌ No agent worker reachable, falling back to subprocess")
+            _spawn(_run_agent_subprocess(req.call_id, req.exercise, agent_token))
+    else:
+        _spawn(_run_agent_subprocess(req.call_id, req.exercise, agent_token))
+
+    return {"status": "agent_launching", "call_id": req.call_id}
+
+
+def _reserve_slot() -> bool:
+    if app.state.active_sessions >= MAX_SESSIONS:
+        return False
+    app.state.active_sessions += 1
+    return True
+
+
+def _release_slot() -> None:
+    app.state.active_sessions -= 1
+
+
+def _spawn(coro) -> None:
+    # Keep a reference so the task isn't garbage-collected mid-session
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
+
+async def _run_session(call_id: str, exercise: str, agent_token: str):
+    # Runs in the slot start_agent reserved for it
+    import rehab_agent
     try:
-        chat = StreamChat(api_key=key, api_secret=secret)
-        chat.upsert_user({"id": AGENT_USER_ID, "name": "REHAB AI", "role": "admin"})
-        agent_token = chat.create_token(AGENT_USER_ID)
-        print(f"[RehabAI] ✅ Agent token generated for '{AGENT_USER_ID}'")
+        await rehab_agent.run_agent(
+            call_id, "default", exercise, agent_token=agent_token, join_delay=JOIN_DELAY,
+        )
+        log.info(f"[RehabAI] ✅ Agent finished cleanly")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Stream setup failed: {e}")
+        log.exception(f"[RehabAI] ❌ Agent session {call_id} failed: {e}")
+    finally:
+        app.state.sessions.pop(call_id, None)
+        _release_slot()
 
-    print(f"\n{'='*50}")
-    print(f"[RehabAI] Starting agent: call_id={req.call_id} exercise={req.exercise}")
 
-    _launch_agent_thread(req.call_id, req.exercise, agent_token)
+def _job(call_id: str, exercise: str, agent_token: str) -> bytes:
+    """One session for an agent process, as the JSON line rehab_agent.py reads."""
+    return orjson.dumps({
+        "call_id":     call_id,
+        "call_type":   "default",
+        "exercise":    exercise,
+        "agent_token": agent_token,
+        # The agent waits for the patient itself, after its own startup
+        "join_delay":  JOIN_DELAY,
+    }) + b"\n"
 
-    return {"status": "agent_launching", "call_id": req.call_id}
 
+async def _dispatch_to_workers(sockets: list[str], job: bytes) -> str:
+    """Offer `job` to each worker in turn: "accepted", "full" (all that answered
+    rejected it) or "unavailable" (none answered)."""
+    full = False
+    for socket_path in sockets:
+        try:
+            # A worker that is alive but wedged must not hold the patient up forever
+            reply = await asyncio.wait_for(_offer_job(socket_path, job), WORKER_REPLY_TIMEOUT)
+        except (OSError, ValueError) as e:  # TimeoutError is an OSError, JSONDecodeError a ValueError
+            log.error(f"[RehabAI] ❌ Agent worker {socket_path} unavailable: {e!r}")  # a timeout has no message
+            continue
+        if reply.get("status") == "accepted":
+            log.info(f"[RehabAI] ✅ Session handed to agent worker {socket_path}")
+            return "accepted"
+        log.warning(f"[RehabAI] Agent worker {socket_path} rejected job: {reply.get('detail')}")
+        full = True
+    return "full" if full else "unavailable"
 
-def _launch_agent_thread(call_id: str, exercise: str, agent_token: str):
-    agent_script = Path(__file__).parent / "rehab_agent.py"
 
-    env = {
-        **os.environ,
-        "CALL_ID":            call_id,
-        "CALL_TYPE":          "default",
-        "EXERCISE":           exercise,
-        "STREAM_AGENT_TOKEN": agent_token,
-        "STREAM_AGENT_ID":    AGENT_USER_ID,
-    }
+async def _offer_job(socket_path: str, job: bytes) -> dict:
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        writer.write(job)
+        await writer.drain()
+        return orjson.loads(await reader.readline() or b"{}")
+    finally:
+        writer.close()
+
 
-    def run_in_thread():
-        # Wait 4 seconds for patient to fully join the call first
-        print(f"[RehabAI] Waiting 4s for patient to join call...")
-        time.sleep(4)
+async def _run_agent_subprocess(call_id: str, exercise: str, agent_token: str):
+    """Runs in a slot reserved by the caller, and frees it once the child is gone."""
+    try:
+        await _agent_subprocess(call_id, exercise, agent_token)
+    finally:
+        _release_slot()
+
+
+async def _agent_subprocess(call_id: str, exercise: str, agent_token: str):
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, AGENT_SCRIPT, "--stdin",
+            env=_BASE_ENV,
+            stdin=asyncio.subprocess.PIPE,
+            # Inherit our stdout: the child's lines reach the log as-is,
+            # without being read, decoded and re-logged here
+        )
+    except NotImplementedError:
+        # A selector loop on Windows can't spawn subprocesses. _winfix installs the
+        # proactor policy, but `uvicorn --reload` / `--workers` switch back to selector.
+        log.error("[RehabAI] ❌ This event loop can't run subprocesses; on Windows start "
+                  "the server without --reload, or use AGENT_MODE=inprocess")
+        return
+    except Exception as e:
+        log.exception(f"[RehabAI] ❌ Launch failed: {e}")
+        return
+    try:
+        proc.stdin.write(_job(call_id, exercise, agent_token))
+        await proc.stdin.drain()
+        proc.stdin.close()
+    except (BrokenPipeError, ConnectionResetError) as e:
+        # No job, no session: stop the child, and keep its slot until it is reaped below
+        log.error(f"[RehabAI] ❌ Agent process {proc.pid} did not take its job: {e}")
         try:
-            proc = subprocess.Popen(
-                [sys.executable, str(agent_script)],
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-            )
-            for line in proc.stdout:
-                print(f"[AGENT] {line.decode(errors='replace').rstrip()}", flush=True)
-            proc.wait()
-            code = proc.returncode
-            if code == 0:
-                print(f"[RehabAI] ✅ Agent finished cleanly")
-            else:
-                print(f"[RehabAI] ❌ Agent exited with code {code}")
-        except Exception as e:
-            print(f"[RehabAI] ❌ Launch failed: {e}")
-            import traceback
-            traceback.print_exc()
+            proc.kill()
+        except ProcessLookupError:
+            pass  # already exited
+    else:
+        log.info(f"[RehabAI] ✅ Agent process launched (pid {proc.pid})")
 
-    t = threading.Thread(target=run_in_thread, daemon=True)
-    t.start()
-    print(f"[RehabAI] ✅ Agent thread launched")
+    code = await proc.wait()
+    if code == 0:
+        log.info(f"[RehabAI] ✅ Agent finished cleanly")
+    else:
+        log.error(f"[RehabAI] ❌ Agent exited with code {code}")
 
 
-if __name__ == "__main__":
+def serve(port: int = 8000) -> None:
+    """Run the server (used by `python server.py` and `python main.py`).
+
+    REHAB_RELOAD=1 gives the single-process auto-reloading dev server. Otherwise
+    WEB_CONCURRENCY worker processes are started, one by default: MAX_SESSIONS,
+    the agent pool and the Stream connection pool are all per process, so every
+    extra worker multiplies them.
+    """
+    import importlib.util
     import uvicorn
-    uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # libuv loop + C HTTP parser on POSIX (both ship with uvicorn[standard]);
+    # uvloop doesn't support Windows, where uvicorn keeps the asyncio loop
+    fast = sys.platform != "win32" and all(
+        importlib.util.find_spec(m) for m in ("uvloop", "httptools")
+    )
+    reload = os.environ.get("REHAB_RELOAD") == "1"
+    workers = 1 if reload else int(os.environ.get("WEB_CONCURRENCY") or 1)
+    uvicorn.run(
+        "server:app", host="0.0.0.0", port=port,
+        reload=reload, workers=workers,
+        loop="uvloop" if fast else "auto",
+        http="httptools" if fast else "auto",
+    )
+
+
+if __name__ == "__main__":
+    serve()
\ No newline at end of file
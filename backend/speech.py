@@ -0,0 +1,145 @@
+"""
+RehabAI - Sentence-level streaming from the LLM into TTS
+"""
+import asyncio
+import logging
+import re
+
+# A sentence is complete once it ends in terminal punctuation (plus optional quote/space)
+SENTENCE_END = re.compile(r"""[.?!]["')\]]*(\s+|$)""")
+# Words whose trailing "." doesn't end the sentence ("e.g. ", "Dr. ")
+ABBREVIATIONS = {"e.g", "i.e", "dr", "mr", "mrs", "ms", "vs", "approx"}
+MAX_WORDS = 80  # flush long run-on output even without punctuation
+MAX_PENDING = 4  # sentences queued ahead of TTS; the LLM side waits for room beyond this
+
+log = logging.getLogger("rehabai.agent")
+
+
+def skip_spoken(text: str, spoken: str) -> str:
+    """The part of `text` after its first len(non-space chars of `spoken`) characters.
+
+    The final response rarely matches the streamed deltas byte for byte (leading
+    space, collapsed or stripped whitespace), so only non-whitespace counts.
+    """
+    remaining = sum(not c.isspace() for c in spoken)
+    for i, c in enumerate(text):
+        if remaining == 0:
+            return text[i:]
+        if not c.isspace():
+            remaining -= 1
+    return ""
+
+
+def split_sentences(text: str) -> tuple[list[str], str]:
+    """Split `text` into complete sentences and the unfinished remainder."""
+    sentences, start = [], 0
+    for m in SENTENCE_END.finditer(text):
+        if m.end() == len(text) and not m.group(1):
+            # "...3." at the very end may still be "...3.5" — wait for the next delta
+            break
+        words = text[start:m.start()].split()
+        if m.group().startswith(".") and words and words[-1].lstrip("(\"'").lower() in ABBREVIATIONS:
+            continue
+        sentences.append(text[start:m.end()])
+        start = m.end()
+    rest = text[start:]
+    if len(rest.split()) >= MAX_WORDS:
+        sentences.append(rest)
+        rest = ""
+    return sentences, rest
+
+
+class SentenceStreamer:
+    """Speak an LLM response sentence by sentence while it is still being generated.
+
+    `feed()` takes streamed deltas; `send()` replaces the TTS's own send and is what
+    the agent pipeline calls with the full response — it only speaks the part not
+    already queued from deltas, and returns once everything has been spoken.
+    Sentences play strictly in order; `cancel()` drops everything pending (barge-in)
+    and the rest of the response being streamed, up to and including its send().
+
+    The LLM side and the TTS side only meet at a bounded queue. Within a response
+    the producer waits for room, so no sentence of it is lost however far decoding
+    runs ahead of speech. Sentences left over from an earlier response are dropped
+    once a newer one starts — coaching about a rep that is already over is not
+    worth the delay.
+    """
+
+    def __init__(self, speak, max_pending: int = MAX_PENDING):
+        self._speak = speak
+        self._queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue(maxsize=max_pending)
+        self._put_lock = asyncio.Lock()  # FIFO: keeps concurrent feed() calls in order
+        self._buffer = ""   # unfinished sentence from deltas
+        self._queued = ""   # text of this response already handed to the queue
+        self._response = 0  # number of the response being streamed in
+        self._floor = 0     # queued sentences of responses before this one are stale
+        self._worker: asyncio.Task | None = None
+        self._current: asyncio.Task | None = None
+        self._cancelled = False  # barged in on: drop this response's remaining deltas and send()
+
+    async def feed(self, delta: str) -> None:
+        if self._cancelled:
+            return
+        self._buffer += delta
+        sentences, self._buffer = split_sentences(self._buffer)
+        self._queued += "".join(sentences)
+        if sentences:
+            await self._put(self._response, sentences)
+
+    async def send(self, text: str, *args, **kwargs) -> None:
+        response = self._response
+        self._response += 1  # deltas from here on belong to the next response
+        if self._cancelled:
+            self._cancelled = False  # next response starts fresh
+            self._buffer = self._queued = ""
+            return
+        if self._queued:
+            text = skip_spoken(text, self._queued)
+        self._buffer = self._queued = ""
+        sentences, rest = split_sentences(text)
+        await self._put(response, sentences + [rest])
+        if self._worker is not None and not self._worker.done():
+            # Callers treat `await tts.send()` as "done speaking"; shield so a
+            # cancelled caller doesn't also kill speech for the next response
+            await asyncio.shield(self._worker)
+
+    def cancel(self) -> None:
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self._current is not None:
+            self._current.cancel()
+        # Only a response still streaming in has a send() to come; _queued stays so
+        # the pipeline can't slip anything past the flag
+        self._cancelled = bool(self._queued or self._buffer)
+        # A put() already waiting for room still lands; this marks it stale
+        self._floor = self._response + self._cancelled
+        self._buffer = ""
+
+    async def _put(self, response: int, sentences: list[str]) -> None:
+        async with self._put_lock:
+            for sentence in sentences:
+                if response < self._floor:
+                    return  # barged in on
+                if not sentence.strip():
+                    continue
+                self._floor = response  # anything older still queued is stale
+                if self._worker is None or self._worker.done():
+                    self._worker = asyncio.create_task(self._drain())
+                await self._queue.put((response, sentence.strip()))
+
+    async def _drain(self) -> None:
+        while not self._queue.empty():
+            response, sentence = self._queue.get_nowait()
+            if response < self._floor:
+                log.warning(f"[Agent] Stale TTS sentence dropped: {sentence[:40]!r}")
+                continue
+            self._current = asyncio.create_task(self._speak(sentence))
+            try:
+                await self._current
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # we were cancelled ourselves, not just the utterance
+            except Exception as e:
+                log.error(f"[Agent] TTS chunk failed: {e}")
+            finally:
+                self._current = None
@@ -0,0 +1,240 @@
+"""
+RehabAI - Shared, dynamically batched YOLO pose inference
+
+When several sessions run in one process (in-process server or agent worker),
+each YOLOPoseProcessor would otherwise hold its own copy of the model and
+run batch-1 forward passes. Here one model instance serves every session:
+frames that arrive within MAX_WAIT of each other go through a single
+forward pass of up to BATCH_MAX images. MotionGatedModel additionally
+skips inference on frames where the patient isn't moving.
+"""
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import logging
+import queue
+import sys
+import threading
+import time
+
+BATCH_MAX = 8
+MAX_WAIT  = 0.010  # seconds to wait for more frames before running a partial batch
+MOTION_HEARTBEAT = 2.0  # seconds; re-run pose at least this often even on a still frame
+
+# Attribute names YOLOPoseProcessor versions have used for their ultralytics model
+_MODEL_ATTRS = ("pose_model", "model", "yolo_model")
+_build_lock = threading.Lock()  # shared_processor temporarily rebinds a module global
+
+log = logging.getLogger("rehabai.agent")
+
+
+class PoseBatcher:
+    """Owns one ultralytics model; only its worker thread ever calls it."""
+
+    def __init__(self, model, batch_max: int = BATCH_MAX, max_wait: float = MAX_WAIT):
+        self.model = model  # read-only from other threads
+        self._batch_max = batch_max
+        self._max_wait = max_wait
+        self._requests: queue.Queue = queue.Queue()
+        threading.Thread(target=self._loop, name="pose-batcher", daemon=True).start()
+
+    def infer(self, source, **kwargs):
+        """Blocking predict(). Single frames are batched with other callers' frames."""
+        return self._submit(source, kwargs).result()
+
+    async def ainfer(self, source, **kwargs):
+        return await asyncio.wrap_future(self._submit(source, kwargs))
+
+    def _submit(self, source, kwargs: dict) -> concurrent.futures.Future:
+        fut = concurrent.futures.Future()
+        # Lists and streams are already batches of their own — run them as-is
+        batchable = not kwargs.get("stream") and not isinstance(source, (list, tuple))
+        self._requests.put((source, kwargs, fut, batchable))
+        return fut
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(batch) < self._batch_max:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # Frames can only share a forward pass when predict() options match
+            groups: dict[str, list] = {}
+            for source, kwargs, fut, batchable in batch:
+                if not batchable:
+                    self._run(lambda: list(self.model.predict(source, **kwargs)), fut)
+                    continue
+                groups.setdefault(repr(sorted(kwargs.items())), []).append((source, kwargs, fut))
+
+            for items in groups.values():
+                self._run_group(items)
+
+    def _run_group(self, items: list) -> None:
+        kwargs = {"verbose": False, **items[0][1]}
+        futures = [fut for _, _, fut in items]
+        if len(items) > 1:
+            frames = [source for source, _, _ in items]
+            try:
+                results = self.model.predict(frames, **kwargs)
+            except Exception as e:
+                # Exports built with a static batch of 1 reject bigger inputs (TensorRT
+                # asserts on the shape, onnxruntime on the batch dim): retry one by one
+                error = e
+            else:
+                for fut, r in zip(futures, results):
+                    fut.set_result([r])
+                return
+        for source, _, fut in items:
+            self._run(lambda: list(self.model.predict(source, **kwargs)), fut)
+        if len(items) > 1 and not any(fut.exception() for fut in futures):
+            log.warning(f"[Agent] Pose model can't batch ({error}); running frames singly. "
+                        "Re-run export_pose_model.py for a dynamic-batch export")
+            self._batch_max = 1
+
+    @staticmethod
+    def _run(fn, fut: concurrent.futures.Future) -> None:
+        try:
+            fut.set_result(fn())
+        except Exception as e:
+            fut.set_exception(e)
+
+
+class BatchedModel:
+    """Drop-in for an ultralytics YOLO model that routes inference through a PoseBatcher."""
+
+    def __init__(self, batcher: PoseBatcher):
+        self._batcher = batcher
+
+    def __call__(self, source=None, **kwargs):
+        return self._batcher.infer(source, **kwargs)
+
+    def predict(self, source=None, **kwargs):
+        return self._batcher.infer(source, **kwargs)
+
+    def to(self, *args, **kwargs):
+        return self  # the batcher placed the model on its device already
+
+    def __getattr__(self, name):
+        # names, task, overrides, ... — read-only metadata, safe to share
+        return getattr(self._batcher.model, name)
+
+
+class MotionGatedModel:
+    """Wraps a pose model and skips inference while the picture is (nearly) still.
+
+    Each frame is shrunk to a 16x16 grayscale thumbnail and compared with the
+    thumbnail of the last frame that was actually inferred. Below `eps` mean
+    absolute difference (0-255 luma) the previous result is returned again —
+    holds and rests between reps don't move the skeleton.
+    """
+
+    def __init__(self, model, eps: float, heartbeat: float = MOTION_HEARTBEAT):
+        self._model = model
+        self._eps = eps
+        self._heartbeat = heartbeat
+        self._ref = None        # thumbnail of the last inferred frame
+        self._last = None       # its results
+        self._last_at = 0.0
+
+    def __call__(self, source=None, **kwargs):
+        return self.predict(source, **kwargs)
+
+    def predict(self, source=None, **kwargs):
+        import numpy as np
+        if not isinstance(source, np.ndarray) or source.ndim != 3 or kwargs.get("stream"):
+            return self._model.predict(source, **kwargs)
+        import cv2
+        thumb = cv2.resize(cv2.cvtColor(source, cv2.COLOR_BGR2GRAY), (16, 16),
+                           interpolation=cv2.INTER_AREA).astype(np.int16)
+        now = time.monotonic()
+        if (self._last is not None and now - self._last_at < self._heartbeat
+                and np.abs(thumb - self._ref).mean() < self._eps):
+            return self._reuse(source)
+        self._last = self._model.predict(source, **kwargs)
+        self._ref, self._last_at = thumb, now
+        return self._last
+
+    def _reuse(self, frame):
+        # Same keypoints, but anything drawn from the results lands on the current frame
+        results = []
+        for r in self._last:
+            r = copy.copy(r)
+            r.orig_img = frame
+            results.append(r)
+        return results
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_batcher(model_path: str, device: str, **overrides) -> PoseBatcher:
+    """One batcher per (model_path, device). `overrides` (imgsz, max_det, ...) are
+    set on the model here, once, and apply to every session sharing it."""
+    from ultralytics import YOLO
+    model = YOLO(model_path)
+    # ultralytics merges model.overrides into each predict()
+    model.overrides.update(device=device, **overrides)
+    return PoseBatcher(model)
+
+
+def shared_processor(cls, model_path: str, device: str, predict_args: dict, **kwargs):
+    """Build a YOLOPoseProcessor that runs on the process-wide batched model.
+
+    `YOLO` is pointed at the shared model while `cls` is constructed, both on
+    ultralytics itself (YOLOPoseProcessor._load_model imports it at call time)
+    and on the processor's module, so a session never loads weights of its own.
+    """
+    import ultralytics
+    shared = BatchedModel(get_batcher(model_path, device, **predict_args))
+    owners = [m for m in (ultralytics, sys.modules.get(cls.__module__)) if hasattr(m, "YOLO")]
+    with _build_lock:
+        originals = [m.YOLO for m in owners]
+        for m in owners:
+            m.YOLO = lambda *args, **kw: shared
+        try:
+            processor = cls(model_path=model_path, device=device, **kwargs)
+        finally:
+            for m, original in zip(owners, originals):
+                m.YOLO = original
+    share_model(processor, shared)  # for processors that load their model some other way
+    return processor
+
+
+def share_model(processor, shared: BatchedModel) -> bool:
+    """Point `processor` at the shared model if it holds an ultralytics one of its own."""
+    for attr in _MODEL_ATTRS:
+        model = getattr(processor, attr, None)
+        if model is not None and type(model).__module__.startswith("ultralytics"):
+            setattr(processor, attr, shared)
+            return True
+    return False
+
+
+def gate_motion(processor, eps: float) -> bool:
+    """Wrap the processor's model in a MotionGatedModel. False if it has no model to wrap."""
+    for attr in _MODEL_ATTRS:
+        model = getattr(processor, attr, None)
+        if model is not None and hasattr(model, "predict"):
+            setattr(processor, attr, MotionGatedModel(model, eps))
+            return True
+    return False
+
+
+def set_predict_defaults(processor, **overrides) -> bool:
+    """Merge `overrides` (imgsz, max_det, ...) into every predict() call of the processor's model."""
+    for attr in _MODEL_ATTRS:
+        model = getattr(processor, attr, None)
+        # ultralytics merges model.overrides into each predict(); BatchedModel proxies it
+        if model is not None and isinstance(getattr(model, "overrides", None), dict):
+            model.overrides.update(overrides)
+            return True
+    return False